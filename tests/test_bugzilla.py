@@ -98,6 +98,9 @@ class FakeResponseID(FakeResponse):
 
 class TestBugzillaTicket(TestCase):
 
+    def setUp(self):
+        ticketutil.ticket.Ticket.invalidate_project_cache()
+
     @patch.object(bugzilla.BugzillaTicket, '_create_requests_session')
     def test_generate_ticket_url(self, mock_session):
         mock_session.return_value = FakeSession()
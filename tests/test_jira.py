@@ -111,6 +111,9 @@ class TestJiraTicket(TestCase):
     _create_requests_session->FakeSession->FakeResponseGetWatchers
     """
 
+    def setUp(self):
+        jira.ticket.Ticket.invalidate_project_cache()
+
     @patch.object(jira.JiraTicket, '_create_requests_session')
     def test_generate_ticket_url(self, mock_session):
         mock_session.return_value = FakeSession()
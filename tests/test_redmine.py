@@ -75,6 +75,9 @@ class FakeResponse(object):
 
 class TestRedmineTicket(TestCase):
 
+    def setUp(self):
+        redmine.ticket.Ticket.invalidate_project_cache()
+
     @patch.object(redmine.RedmineTicket, '_create_requests_session')
     def test_generate_ticket_url(self, mock_session):
         mock_session.return_value = FakeSession()
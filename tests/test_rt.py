@@ -1,7 +1,7 @@
 import logging
 from collections import namedtuple
 from unittest import main, TestCase
-from unittest.mock import patch
+from unittest.mock import call, patch
 
 import requests
 
@@ -32,7 +32,7 @@ class FakeSession(object):
         self.principal = principal
         self.params = params
 
-    def get(self, url):
+    def get(self, url, params=None):
         if 'queue' in url or 'ticket' in url:
             return FakeResponse404(status_code=self.status_code)
         else:
@@ -41,6 +41,9 @@ class FakeSession(object):
     def post(self, url, data=None, files=None):
         return FakeResponse(status_code=self.status_code)
 
+    def mount(self, prefix, adapter):
+        return
+
     def close(self):
         return
 
@@ -66,6 +69,7 @@ class FakeResponse(object):
             self.text = '409 Syntax Error'
         else:
             self.text = ''
+        self.content = self.text.encode()
 
     def raise_for_status(self):
         if self.status_code == 401:
@@ -81,12 +85,16 @@ class FakeResponse404(FakeResponse):
 
 class TestRTTicket(TestCase):
 
+    def setUp(self):
+        rt.ticket.Ticket.invalidate_project_cache()
+
     @patch.object(rt.RTTicket, '_create_requests_session')
     def test_generate_ticket_url(self, mock_session):
         mock_session.return_value = FakeSession()
         ticket = rt.RTTicket(URL, PROJECT, ticket_id=TICKET_ID)
         self.assertEqual(TICKET_URL, ticket._generate_ticket_url())
         self.assertEqual(ticket.request_result, SUCCESS_RESULT)
+        self.assertEqual(ticket._ticket_base, '{0}/REST/1.0/ticket/{1}'.format(URL, TICKET_ID))
 
     @patch.object(rt.RTTicket, '_create_requests_session')
     def test_generate_ticket_url_no_id(self, mock_session):
@@ -95,7 +103,7 @@ class TestRTTicket(TestCase):
         self.assertEqual(None, ticket._generate_ticket_url())
         self.assertEqual(ticket.request_result, SUCCESS_RESULT._replace(url=None))
 
-    @patch('ticketutil.rt.HTTPKerberosAuth')
+    @patch('requests_kerberos.HTTPKerberosAuth')
     @patch('ticketutil.ticket._get_kerberos_principal')
     @patch('ticketutil.rt.requests.Session')
     def test_create_requests_session_kerberos_auth(self, mock_session, mock_principal, mock_auth):
@@ -103,6 +111,7 @@ class TestRTTicket(TestCase):
         with patch.object(rt.RTTicket, '_create_requests_session'):
             ticket = rt.RTTicket(URL, PROJECT, auth='kerberos')
         session = ticket._create_requests_session()
+        mock_principal.assert_not_called()
         self.assertEqual(ticket.principal, mock_principal.return_value)
         self.assertEqual(session.auth, mock_auth.return_value)
         self.assertEqual(session.verify, False)
@@ -111,26 +120,32 @@ class TestRTTicket(TestCase):
     def test_create_requests_session_tuple_auth(self, mock_session):
         mock_session.return_value = FakeSession()
         auth = ('me', 'unbreakablepassword')
-        params = {'user': 'me', 'pass': 'unbreakablepassword'}
+        data = {'user': 'me', 'pass': 'unbreakablepassword'}
         with patch.object(rt.RTTicket, '_create_requests_session'):
             ticket = rt.RTTicket(URL, PROJECT, auth=auth)
-        session = ticket._create_requests_session()
+        with patch.object(FakeSession, 'post', autospec=True, side_effect=FakeSession.post) as mock_post:
+            session = ticket._create_requests_session()
         self.assertEqual(ticket.principal, 'me')
-        self.assertEqual(session.params, params)
+        self.assertEqual(session.params, {})
+        mock_post.assert_called_once_with(session, ticket.auth_url, data=data)
 
     @patch('ticketutil.rt.requests.Session')
     def test_create_requests_session_bad_response(self, mock_session):
         mock_session.return_value = FakeSession(status_code=201)
         with patch.object(rt.RTTicket, '_create_requests_session'):
             ticket = rt.RTTicket(URL, PROJECT)
-        self.assertFalse(ticket._create_requests_session())
+        with self.assertRaises(rt.ticket.TicketException) as cm:
+            ticket._create_requests_session()
+        self.assertIsInstance(cm.exception.__cause__, requests.RequestException)
 
     @patch('ticketutil.rt.requests.Session')
     def test_create_requests_session_unexpected_response(self, mock_session):
         mock_session.return_value = FakeSession(status_code=401)
         with patch.object(rt.RTTicket, '_create_requests_session'):
             ticket = rt.RTTicket(URL, PROJECT)
-        self.assertFalse(ticket._create_requests_session())
+        with self.assertRaises(rt.ticket.TicketException) as cm:
+            ticket._create_requests_session()
+        self.assertIsInstance(cm.exception.__cause__, requests.RequestException)
 
     @patch.object(rt.RTTicket, '_create_requests_session')
     def test_verify_project_unexpected_response(self, mock_session):
@@ -152,6 +167,15 @@ class TestRTTicket(TestCase):
         ticket = rt.RTTicket(URL, PROJECT)
         self.assertTrue(ticket._verify_project(PROJECT))
 
+    @patch.object(rt.RTTicket, '_create_requests_session')
+    def test_verify_project_cached(self, mock_session):
+        mock_session.return_value = FakeSession()
+        rt.RTTicket(URL, PROJECT, auth=('me', 'password'))
+        mock_session.return_value = FakeSession(status_code=404)
+        rt.RTTicket(URL, PROJECT, auth=('me', 'password'))
+        with self.assertRaises(rt.ticket.TicketException):
+            rt.RTTicket(URL, PROJECT, auth=('someone_else', 'password'))
+
     @patch.object(rt.RTTicket, '_create_requests_session')
     def test_get_ticket_content_no_id(self, mock_session):
         mock_session.return_value = FakeSession()
@@ -251,6 +275,35 @@ class TestRTTicket(TestCase):
         request_result = ticket.edit()
         self.assertEqual(request_result, FAILURE_RESULT._replace(error_message='', url=TICKET_URL))
 
+    @patch.object(rt.RTTicket, '_create_requests_session')
+    def test_session_expired(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = rt.RTTicket(URL, PROJECT, auth=('me', 'password'), ticket_id=TICKET_ID)
+        expired = FakeResponse()
+        expired.text = 'RT/4.4.3 401 Credentials required\n'
+        expired.content = expired.text.encode()
+        with patch.object(ticket.s, 'post', side_effect=[expired, FakeResponse(), FakeResponse()]) as mock_post:
+            request_result = ticket.edit(priority='5')
+        self.assertEqual(request_result.status, 'Success')
+        self.assertEqual(mock_post.call_args_list[1], call(ticket.auth_url, data={'user': 'me', 'pass': 'password'}))
+        self.assertEqual(mock_post.call_args_list[2], mock_post.call_args_list[0])
+        with patch.object(ticket.s, 'post', return_value=expired):
+            request_result = ticket.edit(priority='5')
+        self.assertEqual(request_result.status, 'Failure')
+        with patch.object(ticket.s, 'get', return_value=expired):
+            request_result = ticket.get_ticket_content()
+        self.assertEqual(request_result.error_message, 'Error authenticating to {0}'.format(ticket.auth_url))
+
+    @patch.object(rt.RTTicket, '_create_requests_session')
+    def test_edit_ticket_id_set_directly(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = rt.RTTicket(URL, PROJECT)
+        ticket.ticket_id = '5'
+        with patch.object(ticket.s, 'post', wraps=ticket.s.post) as mock_post:
+            request_result = ticket.edit(priority='3')
+        self.assertEqual(mock_post.call_args[0][0], '{0}/REST/1.0/ticket/5/edit'.format(URL))
+        self.assertEqual(request_result.status, 'Success')
+
     @patch.object(rt.RTTicket, '_create_requests_session')
     def test_edit_syntax_error(self, mock_session):
         mock_session.return_value = FakeSession(status_code=409)
@@ -325,6 +378,41 @@ class TestRTTicket(TestCase):
         request_result = ticket.change_status('')
         self.assertEqual(request_result, SUCCESS_RESULT._replace(ticket_content={'header': ['200 OK']}))
 
+    @patch.object(rt.RTTicket, '_create_requests_session')
+    def test_update_no_ticket_id(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = rt.RTTicket(URL, PROJECT)
+        request_result = ticket.update(comment='', status='')
+        self.assertEqual(request_result, FAILURE_RESULT)
+
+    @patch.object(rt.RTTicket, '_create_requests_session')
+    def test_update_bad_request(self, mock_session):
+        mock_session.return_value = FakeSession(status_code=400)
+        error_message = '400 Bad Request'
+        with patch.object(rt.RTTicket, '_verify_ticket_id'):
+            ticket = rt.RTTicket(URL, PROJECT, ticket_id=TICKET_ID)
+        request_result = ticket.update(comment='', status='resolved')
+        self.assertEqual(request_result, FAILURE_RESULT._replace(error_message=error_message, url=TICKET_URL))
+
+    @patch.object(rt.RTTicket, '_create_requests_session')
+    def test_update_syntax_error(self, mock_session):
+        mock_session.return_value = FakeSession(status_code=409)
+        error_message = '409 Syntax Error'
+        ticket = rt.RTTicket(URL, PROJECT, ticket_id=TICKET_ID)
+        request_result = ticket.update(status='resolved')
+        self.assertEqual(request_result, FAILURE_RESULT._replace(error_message=error_message, url=TICKET_URL))
+
+    @patch.object(rt.RTTicket, '_create_requests_session')
+    def test_update(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = rt.RTTicket(URL, PROJECT, ticket_id=TICKET_ID)
+        with patch.object(ticket.s, 'post', wraps=ticket.s.post) as mock_post:
+            request_result = ticket.update(comment='Fixed', status='Resolved')
+        mock_post.assert_called_once_with('{0}/REST/1.0/ticket/{1}/comment'.format(URL, TICKET_ID),
+                                          data={'content': 'Action: correspond\nText: Fixed\nStatus: resolved\n'},
+                                          files=None)
+        self.assertEqual(request_result, SUCCESS_RESULT._replace(ticket_content={'header': ['200 OK']}))
+
     @patch.object(rt.RTTicket, '_create_requests_session')
     def test_add_attachment_no_ticket_id(self, mock_session):
         mock_session.return_value = FakeSession()
@@ -1,9 +1,12 @@
+import base64
+import json
 import logging
 import os
 import sys
+import time
 from collections import namedtuple
 from unittest import main, TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import requests
 
@@ -60,7 +63,7 @@ class FakeResponse(object):
 
     def raise_for_status(self):
         if self.status_code != 666:
-            raise requests.RequestException
+            raise requests.HTTPError(response=self)
 
     def json(self, data=None):
         """Returns json-like mock result of the ServiceNow REST API query
@@ -74,7 +77,7 @@ class FakeResponse(object):
 
 class FakeResponseQuery(FakeResponse):
     """Response on search query,
-    eg. '<REST_URL>?sysparm_query=GOTOnumber%3D<TICKET_ID>'
+    eg. '<REST_URL>' with params {'sysparm_query': 'GOTOnumber=<TICKET_ID>'}
     """
 
     def json(self):
@@ -100,19 +103,25 @@ class FakeSession(object):
         self.status_code = status_code
         self.headers = {'Content-Type': 'application/json', }
 
-    def get(self, url):
+    def get(self, url, params=None):
         if 'sys_choice' in url:
             return FakeResponseSysChoice(status_code=self.status_code)
-        if 'sysparm_query=GOTOnumber%3D' in url:
+        if params and params.get('sysparm_query', '').startswith('GOTOnumber='):
             return FakeResponseQuery(status_code=self.status_code)
         return FakeResponse(status_code=self.status_code)
 
-    def post(self, url, data):
+    def post(self, url, params=None, data=None, json=None):
         return FakeResponse(status_code=self.status_code)
 
-    def put(self, url, data):
+    def put(self, url, json=None):
         return FakeResponse(status_code=self.status_code)
 
+    def mount(self, prefix, adapter):
+        pass
+
+    def close(self):
+        pass
+
 
 def mock_get_ticket_content(self, ticket_id=None):
     return MOCK_RETURN_SUCCESS
@@ -130,6 +139,64 @@ class TestServiceNowTicket(TestCase):
     _create_requests_session->FakeSession->FakeResponseSysChoice
     """
 
+    def setUp(self):
+        servicenow._available_states.clear()
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    def test_verify_project(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        self.assertDictEqual(ticket.available_states, MOCK_STATE)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    def test_verify_project_cached(self, mock_session):
+        mock_session.return_value = FakeSession()
+        servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE, session=FakeSession(status_code=404))
+        self.assertDictEqual(ticket.available_states, MOCK_STATE)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    def test_verify_project_cache_new_session(self, mock_session):
+        mock_session.return_value = FakeSession()
+        servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        mock_session.return_value = FakeSession(status_code=401)
+        with self.assertRaisesRegex(servicenow.TicketException, 'Error authenticating'):
+            servicenow.ServiceNowTicket(TEST_URL, TABLE)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    def test_verify_project_unauthorized(self, mock_session):
+        mock_session.return_value = FakeSession(status_code=401)
+        with self.assertRaisesRegex(servicenow.TicketException, 'Error authenticating'):
+            servicenow.ServiceNowTicket(TEST_URL, TABLE)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    def test_verify_project_cache_expired(self, mock_session):
+        mock_session.return_value = FakeSession()
+        servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE, session=FakeSession(status_code=404))
+        self.assertTrue(ticket._verify_project(TABLE))
+        with patch('servicenow.time.monotonic', return_value=time.monotonic() + servicenow._AVAILABLE_STATES_TTL):
+            self.assertFalse(ticket._verify_project(TABLE))
+
+    @patch('servicenow.Ticket._create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_create_requests_session(self, mock_session):
+        mock_session.return_value = requests.Session()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        self.assertEqual(ticket.s.headers['Content-Type'], 'application/json')
+        self.assertEqual(ticket.s.headers['Accept'], 'application/json')
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_sys_id(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        self.assertIsNone(ticket.ticket_rest_url)
+        self.assertIsNone(ticket._generate_ticket_url())
+        ticket.sys_id = '#34346'
+        self.assertEqual(ticket.ticket_rest_url, '{0}/api/now/v1/table/{1}/#34346'.format(TEST_URL, TABLE))
+        self.assertEqual(ticket._generate_ticket_url(), '{0}/{1}.do?sys_id=#34346'.format(TEST_URL, TABLE))
+
     @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
     @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
     def test_get_ticket_content(self, mock_session):
@@ -146,13 +213,85 @@ class TestServiceNowTicket(TestCase):
         t = ticket.get_ticket_content(ticket_id=TICKET_ID)
         self.assertEqual(t.status, MOCK_RETURN_FAILURE.status)
 
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_get_ticket_content_number(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        with patch.object(ticket.s, 'get', wraps=ticket.s.get) as mock_get:
+            ticket.get_ticket_content(ticket_id=TICKET_ID)
+        mock_get.assert_called_once_with(ticket.rest_url, params={'sysparm_query': 'GOTOnumber={0}'.format(TICKET_ID),
+                                                                  'sysparm_limit': 1,
+                                                                  'sysparm_suppress_pagination_header': 'true'})
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_get_ticket_content_fields(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        sys_id = '0123456789abcdef0123456789abcdef'
+        with patch.object(ticket.s, 'get', wraps=ticket.s.get) as mock_get:
+            ticket.get_ticket_content(ticket_id=sys_id, fields=['number', 'state'])
+        mock_get.assert_called_once_with('{0}/{1}'.format(ticket.rest_url, sys_id),
+                                         params={'sysparm_fields': 'number,state'})
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_get_ticket_content_sys_id(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        sys_id = '0123456789abcdef0123456789abcdef'
+        with patch.object(ticket.s, 'get', wraps=ticket.s.get) as mock_get:
+            t = ticket.get_ticket_content(ticket_id=sys_id)
+        mock_get.assert_called_once_with('{0}/{1}'.format(ticket.rest_url, sys_id), params=None)
+        self.assertDictEqual(t.ticket_content, MOCK_RESULT)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_set_ticket_id_sys_id(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE, ticket_id='0123456789abcdef0123456789abcdef')
+        self.assertEqual(ticket.get_ticket_id(), TICKET_ID)
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        ticket.set_ticket_id('0123456789abcdef0123456789abcdef')
+        self.assertEqual(ticket.get_ticket_id(), TICKET_ID)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_get_ticket_content_id_not_valid(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        with patch.object(FakeResponseQuery, 'json', return_value={'result': []}):
+            t = ticket.get_ticket_content(ticket_id=TICKET_ID)
+        self.assertEqual(t.status, MOCK_RETURN_FAILURE.status)
+        self.assertEqual(t.error_message, 'Ticket {0} is not valid'.format(TICKET_ID))
+
     @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
     def test_create(self, mock_session):
         mock_session.return_value = FakeSession()
         ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
-        t = ticket.create(DESCRIPTION, SHORT_DESCRIPTION, CATEGORY, ITEM)
+        with patch.object(ticket.s, 'get', wraps=ticket.s.get) as mock_get:
+            t = ticket.create(DESCRIPTION, SHORT_DESCRIPTION, CATEGORY, ITEM)
+        mock_get.assert_not_called()
         self.assertDictEqual(t.ticket_content, MOCK_RESULT)
 
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_create_no_description(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        t = ticket.create(SHORT_DESCRIPTION, None, CATEGORY, None)
+        self.assertEqual(t.status, 'Failure')
+        self.assertEqual(t.error_message, "description is a necessary parameter for ticket creation")
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_create_ticket_parameters(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        params = ticket._create_ticket_parameters({'description': 'A "quoted" \\ description', 'item': ITEM})
+        self.assertDictEqual(params, {'description': 'A "quoted" \\ description', 'u_item': ITEM})
+
     @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
     @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
     def test_create_unexpected_response(self, mock_session):
@@ -346,6 +485,109 @@ class TestServiceNowTicket(TestCase):
         t = ticket.add_attachment('file_name')
         self.assertEqual(t.error_message, '')
 
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    @patch('servicenow.ServiceNowTicket.get_ticket_content', mock_get_ticket_content)
+    def test_batch(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE, ticket_id=TICKET_ID)
+        ticket.available_states = MOCK_STATE
+        with patch.object(ticket.s, 'put', wraps=ticket.s.put) as mock_put:
+            with ticket.batch():
+                ticket.add_comment('First comment')
+                ticket.add_comment('Second comment')
+                ticket.change_status('Pending')
+                ticket.rewrite_cc('pzubaty@redhat.com')
+                ticket.add_cc('dranck@redhat.com')
+                mock_put.assert_not_called()
+        mock_put.assert_called_once()
+        self.assertDictEqual(mock_put.call_args[1]['json'],
+                             {'comments': 'First comment\n\nSecond comment',
+                              'state': MOCK_STATE['pending'],
+                              'watch_list': 'pzubaty@redhat.com, dranck@redhat.com'})
+        self.assertEqual(ticket.batch_result.status, 'Success')
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    @patch('servicenow.ServiceNowTicket.get_ticket_content', mock_get_ticket_content)
+    def test_batch_nested(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE, ticket_id=TICKET_ID)
+        with patch.object(ticket.s, 'put', wraps=ticket.s.put) as mock_put:
+            with ticket.batch():
+                ticket.add_comment('a')
+                with ticket.batch():
+                    ticket.add_comment('b')
+                ticket.add_comment('c')
+                mock_put.assert_not_called()
+        mock_put.assert_called_once()
+        self.assertDictEqual(mock_put.call_args[1]['json'], {'comments': 'a\n\nb\n\nc'})
+        self.assertIsNone(ticket._pending)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    @patch('servicenow.ServiceNowTicket.get_ticket_content', mock_get_ticket_content)
+    def test_batch_exception(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE, ticket_id=TICKET_ID)
+        with patch.object(ticket.s, 'put', wraps=ticket.s.put) as mock_put:
+            with self.assertRaises(ValueError):
+                with ticket.batch():
+                    ticket.add_comment('New comment')
+                    raise ValueError
+        mock_put.assert_not_called()
+        self.assertIsNone(ticket._pending)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    @patch('servicenow.ServiceNowTicket.get_ticket_content', mock_get_ticket_content)
+    def test_update_via_batch_api(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE, ticket_id=TICKET_ID)
+        other = servicenow.ServiceNowTicket(TEST_URL, TABLE, ticket_id=TICKET_ID)
+        body = base64.b64encode(json.dumps({'result': {'priority': '2'}}).encode()).decode()
+        response = MagicMock(status_code=200)
+        response.json.return_value = {'serviced_requests': [{'id': '1', 'status_code': 400,
+                                                             'status_text': 'Bad Request'},
+                                                            {'id': '0', 'status_code': 200, 'body': body}]}
+        with patch.object(ticket.s, 'post', return_value=response) as mock_post:
+            results = servicenow.ServiceNowTicket.update_via_batch_api(
+                ticket.s, TEST_URL, [(ticket, {'priority': '2'}), (other, {'category': CATEGORY})])
+        mock_post.assert_called_once()
+        self.assertEqual(mock_post.call_args[0][0], '{0}/api/now/v1/batch'.format(TEST_URL))
+        rest_requests = mock_post.call_args[1]['json']['rest_requests']
+        self.assertEqual(rest_requests[1]['url'], '/api/now/v1/table/{0}/{1}'.format(TABLE, MOCK_RESULT['sys_id']))
+        self.assertDictEqual(json.loads(base64.b64decode(rest_requests[1]['body']).decode()), {'u_category': CATEGORY})
+        self.assertEqual(results[0].status, 'Success')
+        self.assertDictEqual(ticket.ticket_content, {'priority': '2'})
+        self.assertEqual(results[1].status, 'Failure')
+        self.assertEqual(results[1].error_message, 'Bad Request')
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    @patch('servicenow.ServiceNowTicket.get_ticket_content', mock_get_ticket_content)
+    def test_update_via_batch_api_not_sent(self, mock_session):
+        mock_session.return_value = FakeSession()
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE)
+        other = servicenow.ServiceNowTicket('other.servicenow.com', TABLE, ticket_id=TICKET_ID)
+        with patch.object(ticket.s, 'post') as mock_post:
+            results = servicenow.ServiceNowTicket.update_via_batch_api(
+                ticket.s, TEST_URL, [(ticket, {'priority': '2'}), (other, {'priority': '2'})])
+        mock_post.assert_not_called()
+        self.assertEqual(results[0].status, 'Failure')
+        self.assertIn('No ticket ID', results[0].error_message)
+        self.assertEqual(results[1].status, 'Failure')
+        self.assertIn('another ServiceNow instance', results[1].error_message)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    @patch('servicenow.ServiceNowTicket.get_ticket_content', mock_get_ticket_content)
+    def test_update_via_batch_api_unexpected_response(self, mock_session):
+        mock_session.return_value = FakeSession(status_code=404)
+        ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE, ticket_id=TICKET_ID)
+        results = servicenow.ServiceNowTicket.update_via_batch_api(ticket.s, TEST_URL, [(ticket, {'priority': '2'})])
+        self.assertEqual(results[0].status, 'Failure')
+
     @patch('builtins.open')
     @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
     @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
@@ -353,9 +595,82 @@ class TestServiceNowTicket(TestCase):
     def test_add_attachment(self, mock_session, mock_open):
         mock_session.return_value = FakeSession()
         ticket = servicenow.ServiceNowTicket(TEST_URL, TABLE, ticket_id=TICKET_ID)
-        t = ticket.add_attachment('file_name')
+        with patch.object(ticket.s, 'post', wraps=ticket.s.post) as mock_post:
+            t = ticket.add_attachment('file_name')
+        self.assertEqual(mock_post.call_args[0][0],
+                         '{0}/api/now/attachment/file?table_name={1}'.format(TEST_URL, TABLE))
+        self.assertDictEqual(mock_post.call_args[1]['params'],
+                             {'table_sys_id': MOCK_RESULT['sys_id'], 'file_name': 'file_name'})
+        self.assertIs(mock_post.call_args[1]['data'], mock_open.return_value.__enter__.return_value)
         self.assertEqual(t.status, 'Success')
 
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_bulk(self, mock_session):
+        mock_session.return_value = FakeSession()
+
+        def get_ticket_content(self, ticket_id=None):
+            return MOCK_RETURN_SUCCESS._replace(ticket_content=dict(MOCK_RESULT, number=ticket_id))
+
+        with patch.object(servicenow.ServiceNowTicket, 'get_ticket_content', get_ticket_content):
+            tickets = servicenow.ServiceNowTicket.bulk(TEST_URL, TABLE, [TICKET_ID, 'PNT0000002', 'PNT0000003'])
+        mock_session.assert_called_once_with()
+        self.assertEqual([t.ticket_id for t in tickets], [TICKET_ID, 'PNT0000002', 'PNT0000003'])
+        self.assertTrue(all(t.s is mock_session.return_value for t in tickets))
+        self.assertEqual(servicenow.ServiceNowTicket.bulk(TEST_URL, TABLE, []), [])
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_bulk_pool_size(self, mock_session):
+        mock_session.return_value = FakeSession()
+        with patch.object(servicenow.ServiceNowTicket, 'get_ticket_content', mock_get_ticket_content), \
+                patch.object(mock_session.return_value, 'mount') as mock_mount:
+            servicenow.ServiceNowTicket.bulk(TEST_URL, TABLE, [TICKET_ID, 'PNT0000002'], max_workers=20)
+        self.assertEqual(mock_mount.call_args[0][1]._pool_maxsize, 20)
+
+    @patch.object(servicenow.ServiceNowTicket, '_create_requests_session')
+    @patch('servicenow.ServiceNowTicket._verify_project', mock_verify_project)
+    def test_bulk_ticket_not_valid(self, mock_session):
+        mock_session.return_value = FakeSession()
+
+        def get_ticket_content(self, ticket_id=None):
+            return MOCK_RETURN_SUCCESS if ticket_id == TICKET_ID else MOCK_RETURN_FAILURE
+
+        with patch.object(servicenow.ServiceNowTicket, 'get_ticket_content', get_ticket_content), \
+                patch.object(mock_session.return_value, 'close') as mock_close:
+            with self.assertRaises(servicenow.TicketException):
+                servicenow.ServiceNowTicket.bulk(TEST_URL, TABLE, [TICKET_ID, 'PNT0000002'])
+        mock_close.assert_called_once_with()
+
+    def test_prepare_ticket_fields(self):
+        fields = {'category': CATEGORY, 'topic': 'topic', 'email_from': 'me@redhat.com', 'priority': '2'}
+        expected_result = {'u_category': CATEGORY, 'u_topic_reportable': 'topic',
+                           'u_email_from_address': 'me@redhat.com', 'priority': '2'}
+        self.assertDictEqual(servicenow._prepare_ticket_fields(fields), expected_result)
+
+    def test_split_watch_list(self):
+        self.assertEqual(servicenow._split_watch_list('a@redhat.com, b@redhat.com,'), ['a@redhat.com', 'b@redhat.com'])
+        self.assertEqual(servicenow._split_watch_list(''), [])
+
+
+class TestServiceNowBatch(TestCase):
+
+    def test_execute(self):
+        ticket1 = MagicMock()
+        ticket2 = MagicMock()
+        ticket1.edit.return_value = 'edit1'
+        ticket1.add_comment.return_value = 'comment1'
+        ticket2.edit.return_value = 'edit2'
+        batch = servicenow.ServiceNowBatch(max_workers=2)
+        batch.add(ticket1, 'edit', priority='2')
+        batch.add(ticket2, 'edit', priority='3')
+        batch.add(ticket1, 'add_comment', 'New comment')
+        self.assertEqual(batch.execute(), ['edit1', 'edit2', 'comment1'])
+        ticket1.edit.assert_called_once_with(priority='2')
+        ticket1.add_comment.assert_called_once_with('New comment')
+        ticket2.edit.assert_called_once_with(priority='3')
+        self.assertEqual(batch.operations, [])
+
 
 if __name__ == '__main__':
     main()
@@ -1,4 +1,5 @@
 import logging
+import os
 from collections import namedtuple
 from unittest import main, TestCase
 from unittest.mock import patch
@@ -27,6 +28,9 @@ class FakeSession(object):
     def get(self, url):
         return FakeResponse(status_code=self.status_code)
 
+    def mount(self, prefix, adapter):
+        return
+
     def close(self):
         return
 
@@ -49,7 +53,7 @@ class ChildTicket(ticket.Ticket):
     Mock children class from Ticket necessary for initialization of attributes the parent class does not have.
     """
 
-    def __init__(self, project, ticket_id, auth=None, principal=None):
+    def __init__(self, project, ticket_id, auth=None, principal=None, session=None):
         self.url = URL
         self.principal = principal
         self.ticketing_tool = 'Child'
@@ -60,7 +64,7 @@ class ChildTicket(ticket.Ticket):
             self.auth = 'kerberos'
             self.auth_url = '{0}/step-auth-gss'.format(self.url)
 
-        super(ChildTicket, self).__init__(project, ticket_id)
+        super(ChildTicket, self).__init__(project, ticket_id, session=session)
 
     def _verify_project(self, project):
         return True
@@ -73,6 +77,7 @@ class ChildTicket(ticket.Ticket):
 
     def _verify_ticket_id(self, ticket_id):
         if 'PROJECT-00' in ticket_id:
+            self.ticket_id = ticket_id
             return True
         else:
             return False
@@ -92,6 +97,10 @@ class FakeCredentials(object):
 
 class TestTicket(TestCase):
 
+    def setUp(self):
+        ticket._kerberos_principals.clear()
+        ticket.Ticket.invalidate_project_cache()
+
     @patch.object(ticket.Ticket, '_create_requests_session')
     def test_verify_ticket_id(self, mock_session):
         mock_session.return_value = FakeSession()
@@ -112,6 +121,14 @@ class TestTicket(TestCase):
         self.assertEqual(t.ticket_url, TICKET_URL)
         self.assertEqual(t.request_result, RETURN_RESULT('Success', None, None, None))
 
+    @patch.object(ticket.Ticket, '_create_requests_session')
+    def test_set_ticket_id_unchanged(self, mock_session):
+        t = ChildTicket(PROJECT, TICKET_ID)
+        with patch.object(ChildTicket, '_verify_ticket_id') as mock_verify_ticket_id:
+            request_result = t.set_ticket_id(TICKET_ID)
+        mock_verify_ticket_id.assert_not_called()
+        self.assertEqual(request_result.status, 'Success')
+
     @patch.object(ticket.Ticket, '_create_requests_session')
     def test_set_ticket_id_failure(self, mock_session):
         t = ChildTicket(PROJECT, TICKET_ID)
@@ -124,12 +141,30 @@ class TestTicket(TestCase):
         t = ChildTicket(PROJECT, TICKET_ID)
         self.assertEqual(t.get_ticket_id(), TICKET_ID)
 
+    @patch.object(ticket.Ticket, '_create_requests_session')
+    def test_verify_project_cached(self, mock_session):
+        with patch.object(ChildTicket, '_verify_project', return_value=True) as mock_verify_project:
+            ChildTicket(PROJECT, TICKET_ID, auth=('me', 'password'))
+            ChildTicket(PROJECT, TICKET_ID, auth=('me', 'password'))
+            mock_verify_project.assert_called_once_with(PROJECT)
+            ChildTicket(PROJECT, TICKET_ID, auth=('someone_else', 'password'))
+            self.assertEqual(mock_verify_project.call_count, 2)
+            ticket.Ticket.invalidate_project_cache()
+            ChildTicket(PROJECT, TICKET_ID, auth=('me', 'password'))
+            self.assertEqual(mock_verify_project.call_count, 3)
+            ChildTicket(PROJECT, TICKET_ID)
+            ChildTicket(PROJECT, TICKET_ID)
+            self.assertEqual(mock_verify_project.call_count, 4)
+            with patch.dict(os.environ, {'KRB5CCNAME': 'FILE:/tmp/krb5cc_other'}):
+                ChildTicket(PROJECT, TICKET_ID)
+            self.assertEqual(mock_verify_project.call_count, 5)
+
     @patch.object(ticket.Ticket, '_create_requests_session')
     def test_get_ticket_url(self, mock_session):
         t = ChildTicket(PROJECT, TICKET_ID)
         self.assertEqual(t.get_ticket_url(), TICKET_URL)
 
-    @patch('ticketutil.ticket.HTTPKerberosAuth')
+    @patch('requests_kerberos.HTTPKerberosAuth')
     @patch('ticketutil.ticket.requests.Session')
     @patch.object(ticket, '_get_kerberos_principal')
     def test_create_request_session_kerberos_auth(self, mock_principal, mock_session, mock_auth):
@@ -150,14 +185,26 @@ class TestTicket(TestCase):
         self.assertEqual(t.principal, None)
         self.assertEqual(s.auth, auth)
 
+    @patch('ticketutil.ticket.requests.Session')
+    def test_create_request_session_skip_auth_probe(self, mock_session):
+        auth = ('username', 'password')
+        with patch.object(ticket.Ticket, '_create_requests_session'):
+            t = ChildTicket(PROJECT, TICKET_ID, auth=auth)
+        t.skip_auth_probe = True
+        s = t._create_requests_session()
+        self.assertEqual(s, mock_session.return_value)
+        self.assertEqual(s.auth, auth)
+        s.get.assert_not_called()
+
     @patch('ticketutil.ticket.requests.Session')
     def test_create_request_session_unexpected_response(self, mock_session):
         mock_session.return_value = FakeSession(status_code=401)
         auth = ('username', 'password')
         with patch.object(ticket.Ticket, '_create_requests_session'):
             t = ChildTicket(PROJECT, TICKET_ID, auth=auth)
-        s = t._create_requests_session()
-        self.assertEqual(s, None)
+        with self.assertRaises(ticket.TicketException) as cm:
+            t._create_requests_session()
+        self.assertIsInstance(cm.exception.__cause__, requests.RequestException)
 
     @patch('ticketutil.ticket.requests.Session')
     def test_close_requests_session(self, mock_session):
@@ -166,11 +213,30 @@ class TestTicket(TestCase):
         request_result = t.close_requests_session()
         self.assertEqual(request_result, RETURN_RESULT('Success', None, None, None))
 
-    @patch('ticketutil.ticket.gssapi.Credentials')
+    @patch.object(ticket.Ticket, '_create_requests_session')
+    def test_context_manager(self, mock_session):
+        with ChildTicket(PROJECT, TICKET_ID) as t:
+            s = t.s
+        s.close.assert_called_once_with()
+        self.assertIs(t.s, s)
+        self.assertEqual(t.close_requests_session(), RETURN_RESULT('Success', None, None, None))
+
+    @patch.object(ticket.Ticket, '_create_requests_session')
+    def test_shared_session(self, mock_session):
+        session = ChildTicket(PROJECT, TICKET_ID).s
+        mock_session.reset_mock()
+        t = ChildTicket(PROJECT, TICKET_ID, session=session)
+        mock_session.assert_not_called()
+        self.assertIs(t.s, session)
+        t.close_requests_session()
+        session.close.assert_not_called()
+
+    @patch('gssapi.Credentials')
     def test_get_kerberos_principal(self, mock_credentials):
         mock_credentials.return_value = FakeCredentials(u'me@REDHAT.COM')
         ticket._get_kerberos_principal()
         self.assertEqual(ticket._get_kerberos_principal(), 'me@redhat.com')
+        mock_credentials.assert_called_once_with(usage='initiate')
 
 
 if __name__ == '__main__':
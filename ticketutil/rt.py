@@ -2,7 +2,6 @@ import logging
 import re
 
 import requests
-from requests_kerberos import HTTPKerberosAuth, DISABLED
 
 from . import ticket
 
@@ -10,6 +9,19 @@ __author__ = 'dranck, rnester, kshirsal'
 
 logger = logging.getLogger(__name__)
 
+# RT's API returns 200 even if a request failed, so responses are scanned for these markers.
+# They are pure ASCII, which lets us check the raw response bytes without decoding them.
+_OK = b'200'
+_ERR_COULD_NOT_CREATE = b'Could not create ticket'
+_ERR_SYNTAX_ERROR = b'409 Syntax Error'
+_ERR_BAD_REQUEST = b'400 Bad Request'
+# Returned with a 200 status code once the RT session cookie has expired.
+_ERR_CREDENTIALS_REQUIRED = b'401 Credentials required'
+
+# Field names as sent in the content of RT requests, for the commonly used ticket fields.
+_FIELD_TITLES = {key: key.title() for key in ('priority', 'owner', 'cc', 'admincc', 'queue', 'subject', 'status',
+                                              'requestor')}
+
 
 class RTTicket(ticket.Ticket):
     """
@@ -19,6 +31,7 @@ class RTTicket(ticket.Ticket):
         self.ticketing_tool = 'RT'
 
         self.auth = auth
+        self._principal = None
 
         # RT URLs
         self.url = url[:-1] if url.endswith('/') else url
@@ -28,6 +41,30 @@ class RTTicket(ticket.Ticket):
         # Call our parent class's init method which creates our requests session.
         super(RTTicket, self).__init__(project, ticket_id)
 
+    @property
+    def principal(self):
+        """
+        The requestor used when creating tickets.
+        With Kerberos Auth, the principal is only looked up on first use, so read-only callers never query GSSAPI.
+        :return: The principal.
+        """
+        if self._principal is None and self.auth == 'kerberos':
+            self._principal = ticket._get_kerberos_principal()
+        return self._principal
+
+    @principal.setter
+    def principal(self, principal):
+        self._principal = principal
+
+    @property
+    def _ticket_base(self):
+        """
+        The REST URL of the current ticket, which the API calls build their URLs from.
+        It is derived from ticket_id, so it can't get out of step with it.
+        :return: The URL.
+        """
+        return "{0}/ticket/{1}".format(self.rest_url, self.ticket_id)
+
     def _generate_ticket_url(self):
         """
         Generates the ticket URL out of the url, project, and ticket_id.
@@ -50,32 +87,70 @@ class RTTicket(ticket.Ticket):
         Creates a Requests Session and authenticates to base API URL with HTTP Basic Auth or Kerberos Auth.
         We're using a Session to persist cookies across all requests made from the Session instance.
         :return s: Requests Session.
+        :raises TicketException: If authentication fails. The requests exception is chained as its cause.
         """
         s = requests.Session()
+        ticket._mount_http_adapter(s)
         # Kerberos Auth
         if self.auth == 'kerberos':
-            self.principal = ticket._get_kerberos_principal()
+            # Kerberos support is only imported when it is used, so tuple auth users don't load gssapi.
+            from requests_kerberos import DISABLED, HTTPKerberosAuth
             s.auth = HTTPKerberosAuth(mutual_authentication=DISABLED)
             s.verify = False
         # HTTP Basic Auth
         if isinstance(self.auth, tuple):
-            username, password = self.auth
-            self.principal = username
-            s.params.update({'user': username, 'pass': password})
+            self.principal = self.auth[0]
 
         # Try to authenticate to auth_url.
         try:
-            r = s.get(self.auth_url)
-            logger.debug("Create requests session: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-            # Special case for RT. A 200 status code is still returned if authentication failed. Have to check r.text.
-            if '200' not in r.text:
-                raise requests.RequestException
-            logger.info("Successfully authenticated to {0}".format(self.ticketing_tool))
+            self._authenticate(s)
+            logger.info("Successfully authenticated to %s", self.ticketing_tool)
             return s
         except requests.RequestException as e:
-            logger.error("Error authenticating to {0}".format(self.auth_url))
+            logger.error("Error authenticating to %s", self.auth_url)
+            logger.error(e)
             s.close()
+            raise ticket.TicketException("Error authenticating to {0}".format(self.auth_url)) from e
+
+    def _authenticate(self, s):
+        """
+        Authenticates the Requests Session to auth_url.
+        RT's built-in authentication expects the credentials as form fields. They are only sent with this request;
+        RT then sets a session cookie which authenticates all later requests of the Session.
+        :param s: Requests Session.
+        :return:
+        :raises requests.RequestException: If authentication fails.
+        """
+        if isinstance(self.auth, tuple):
+            username, password = self.auth
+            r = s.post(self.auth_url, data={'user': username, 'pass': password})
+        else:
+            r = s.get(self.auth_url)
+        logger.debug("Authenticate: status code: %s", r.status_code)
+        r.raise_for_status()
+        # Special case for RT. A 200 status code is still returned if authentication failed. Check the body.
+        if _OK not in r.content:
+            raise requests.RequestException("Error authenticating to {0}".format(self.auth_url))
+
+    def _request(self, method, url, **kwargs):
+        """
+        Sends a request with the Requests Session.
+        If RT's session cookie has expired, authenticates again and resends the request once.
+        :param method: 'get' or 'post'.
+        :param url: The URL to send the request to.
+        :param kwargs: Arguments of the request.
+        :return: r: The response.
+        :raises requests.RequestException: If the request or authenticating again fails.
+        """
+        r = getattr(self.s, method)(url, **kwargs)
+        if _ERR_CREDENTIALS_REQUIRED in r.content:
+            logger.info("Session of %s expired, authenticating again", self.ticketing_tool)
+            self._authenticate(self.s)
+            # Files which were already sent are read again from the start.
+            for f in (kwargs.get('files') or {}).values():
+                f.seek(0)
+            r = getattr(self.s, method)(url, **kwargs)
+        return r
 
     def _verify_project(self, project):
         """
@@ -85,7 +160,7 @@ class RTTicket(ticket.Ticket):
         """
         try:
             r = self.s.get("{0}/queue/{1}".format(self.rest_url, project))
-            logger.debug("Verify project: status code: {0}".format(r.status_code))
+            logger.debug("Verify project: status code: %s", r.status_code)
             r.raise_for_status()
         except requests.RequestException as e:
             logger.error("Unexpected error occurred when verifying project")
@@ -93,12 +168,12 @@ class RTTicket(ticket.Ticket):
             return False
 
         # RT's API returns 200 even if the project is not valid. We need to parse the response.
-        error_response = "No queue named {0} exists".format(project)
-        if error_response in r.text:
-            logger.error("Project {0} is not valid".format(project))
+        error_response = "No queue named {0} exists".format(project).encode()
+        if error_response in r.content:
+            logger.error("Project %s is not valid", project)
             return False
         else:
-            logger.debug("Project {0} is valid".format(project))
+            logger.debug("Project %s is valid", project)
             return True
 
     def get_ticket_content(self, ticket_id=None, option='show'):
@@ -118,8 +193,8 @@ class RTTicket(ticket.Ticket):
                 logger.error(error_message)
                 return self.request_result._replace(status='Failure', error_message=error_message)
         try:
-            r = self.s.get("{0}/ticket/{1}/{2}".format(self.rest_url, ticket_id, option))
-            logger.debug("Get ticket content: status code: {0}".format(r.status_code))
+            r = self._request('get', "{0}/ticket/{1}/{2}".format(self.rest_url, ticket_id, option))
+            logger.debug("Get ticket content: status code: %s", r.status_code)
             r.raise_for_status()
         except requests.RequestException as e:
             error_message = "Error getting ticket content"
@@ -127,10 +202,15 @@ class RTTicket(ticket.Ticket):
             logger.error(e)
             return self.request_result._replace(status='Failure', error_message=error_message)
 
+        if _ERR_CREDENTIALS_REQUIRED in r.content:
+            error_message = "Error authenticating to {0}".format(self.auth_url)
+            logger.error(error_message)
+            return self.request_result._replace(status='Failure', error_message=error_message)
+
         # RT's API returns 200 even if the ticket is not valid. We need to parse the response.
-        error_responses = ["Ticket {0} does not exist.".format(ticket_id),
-                           "Bad Request"]
-        if any(error in r.text for error in error_responses):
+        error_responses = ["Ticket {0} does not exist.".format(ticket_id).encode(),
+                           b"Bad Request"]
+        if any(error in r.content for error in error_responses):
             error_message = "Ticket {0} is not valid".format(ticket_id)
             logger.error(error_message)
             return self.request_result._replace(status='Failure', error_message=error_message)
@@ -195,7 +275,7 @@ class RTTicket(ticket.Ticket):
 
         # Iterate through our options and add them to the params dict.
         for key, value in fields.items():
-            content += '{0}: {1}\n'.format(key.title(), value)
+            content += '{0}: {1}\n'.format(_FIELD_TITLES.get(key) or key.title(), value)
 
         params = {'content': content}
 
@@ -209,25 +289,14 @@ class RTTicket(ticket.Ticket):
         :return: self.request_result: Named tuple containing request status, error_message, and url info.
         """
         # Attempt to create ticket.
-        try:
-            r = self.s.post('{0}/ticket/new'.format(self.rest_url), data=params)
-            logger.debug("Create ticket: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error("Error creating ticket")
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
-
-        # RT's API returns 200 even if the ticket is not valid. We need to parse the response.
-        if 'Could not create ticket' in r.text:
-            error_message = r.text.replace('\n', ' ')
-            logger.error(error_message)
+        ok, content, error_message = self._post('{0}/ticket/new'.format(self.rest_url), params,
+                                                "Error creating ticket", error_markers=(_ERR_COULD_NOT_CREATE,))
+        if not ok:
             return self.request_result._replace(status='Failure', error_message=error_message)
         # Retrieve key from new ticket.
-        ticket_content = r.text
-        self.ticket_id = re.search('Ticket (\d+) created', ticket_content).groups()[0]
+        self.ticket_id = re.search(rb'Ticket (\d+) created', content).group(1).decode()
         self.ticket_url = self._generate_ticket_url()
-        logger.info("Created ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
+        logger.info("Created ticket %s - %s", self.ticket_id, self.ticket_url)
         self.request_result = self.get_ticket_content()
         return self.request_result
 
@@ -256,26 +325,16 @@ class RTTicket(ticket.Ticket):
 
         # Iterate through our kwargs and add them to the content string.
         for key, value in fields.items():
-            content += '{0}: {1}\n'.format(key.title(), value)
+            content += '{0}: {1}\n'.format(_FIELD_TITLES.get(key) or key.title(), value)
 
         params = {'content': content}
 
         # Attempt to edit ticket.
-        try:
-            r = self.s.post("{0}/ticket/{1}/edit".format(self.rest_url, self.ticket_id), data=params)
-            logger.debug("Edit ticket: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error("Error editing ticket")
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
-
-        # RT's API returns 200 even if the ticket is not valid. We need to parse the response.
-        if '409 Syntax Error' in r.text:
-            error_message = r.text.replace('\n', ' ')
-            logger.error(error_message)
+        ok, _, error_message = self._post(self._ticket_base + '/edit', params, "Error editing ticket",
+                                          error_markers=(_ERR_SYNTAX_ERROR,))
+        if not ok:
             return self.request_result._replace(status='Failure', error_message=error_message)
-        logger.info("Edited ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
+        logger.info("Edited ticket %s - %s", self.ticket_id, self.ticket_url)
         self.request_result = self.get_ticket_content()
         return self.request_result
 
@@ -299,21 +358,11 @@ class RTTicket(ticket.Ticket):
         params = {'content': content}
 
         # Attempt to add comment to ticket.
-        try:
-            r = self.s.post('{0}/ticket/{1}/comment'.format(self.rest_url, self.ticket_id), data=params)
-            logger.debug("Add comment: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error("Error adding comment to ticket")
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
-
-        # RT's API returns 200 even if the ticket is not valid. We need to parse the response.
-        if '400 Bad Request' in r.text:
-            error_message = r.text.replace('\n', ' ')
-            logger.error(error_message)
+        ok, _, error_message = self._post(self._ticket_base + '/comment', params,
+                                          "Error adding comment to ticket", error_markers=(_ERR_BAD_REQUEST,))
+        if not ok:
             return self.request_result._replace(status='Failure', error_message=error_message)
-        logger.info("Added comment to ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
+        logger.info("Added comment to ticket %s - %s", self.ticket_id, self.ticket_url)
         self.request_result = self.get_ticket_content()
         return self.request_result
 
@@ -333,21 +382,64 @@ class RTTicket(ticket.Ticket):
         params = {'content': content}
 
         # Attempt to change status of ticket.
-        try:
-            r = self.s.post('{0}/ticket/{1}/edit'.format(self.rest_url, self.ticket_id), data=params)
-            logger.debug("Change status: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error("Error changing status of ticket")
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
+        ok, _, error_message = self._post(self._ticket_base + '/edit', params,
+                                          "Error changing status of ticket", error_markers=(_ERR_SYNTAX_ERROR,))
+        if not ok:
+            return self.request_result._replace(status='Failure', error_message=error_message)
+        logger.info("Changed status of ticket %s - %s", self.ticket_id, self.ticket_url)
+        self.request_result = self.get_ticket_content()
+        return self.request_result
 
-        # RT's API returns 200 even if the ticket is not valid. We need to parse the response.
-        if '409 Syntax Error' in r.text:
-            error_message = r.text.replace('\n', ' ')
+    def update(self, comment=None, status=None, **kwargs):
+        """
+        Adds a comment, changes status and edits fields of a RT ticket using as few requests as possible.
+        When a comment is given, the status change is sent along with the comment in a single request.
+        Keyword arguments are used to specify other ticket fields, which are sent in a single edit request.
+
+        Example:
+        update(comment='Fixed', status='Resolved')
+
+        :param comment: A string representing the comment to be added.
+        :param status: Status to change to.
+        :return: self.request_result: Named tuple containing request status, error_message, and url info.
+        """
+        if not self.ticket_id:
+            error_message = "No ticket ID associated with ticket object. Set ticket ID with set_ticket_id(<ticket_id>)"
             logger.error(error_message)
             return self.request_result._replace(status='Failure', error_message=error_message)
-        logger.info("Changed status of ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
+
+        # Some of the ticket fields need to be in a specific form for the tool.
+        fields = _prepare_ticket_fields(kwargs)
+
+        if comment is not None:
+            # RT requires a special encoding on the comment parameter.
+            encoded_comment = comment.replace('\n', '\n      ')
+
+            content = 'Action: correspond\n'
+            content += 'Text: {0}\n'.format(encoded_comment)
+            if status:
+                content += 'Status: {0}\n'.format(status.lower())
+
+            ok, _, error_message = self._post(self._ticket_base + '/comment', {'content': content},
+                                              "Error updating ticket", error_markers=(_ERR_BAD_REQUEST,))
+            if not ok:
+                return self.request_result._replace(status='Failure', error_message=error_message)
+        elif status:
+            fields['status'] = status.lower()
+
+        if fields:
+            content = ''
+
+            # Iterate through our fields and add them to the content string.
+            for key, value in fields.items():
+                content += '{0}: {1}\n'.format(_FIELD_TITLES.get(key) or key.title(), value)
+
+            ok, _, error_message = self._post(self._ticket_base + '/edit', {'content': content},
+                                              "Error updating ticket", error_markers=(_ERR_SYNTAX_ERROR,))
+            if not ok:
+                return self.request_result._replace(status='Failure', error_message=error_message)
+
+        logger.info("Updated ticket %s - %s", self.ticket_id, self.ticket_url)
         self.request_result = self.get_ticket_content()
         return self.request_result
 
@@ -374,36 +466,61 @@ class RTTicket(ticket.Ticket):
             return self.request_result._replace(status='Failure', error_message=error_message)
 
         # Attempt to attach file.
+        ok, _, error_message = self._post(self._ticket_base + '/comment', params,
+                                          "Error attaching file {0}".format(file_name), files=files,
+                                          success_marker=_OK)
+        if not ok:
+            return self.request_result._replace(status='Failure', error_message=error_message)
+        logger.info("Attached file %s to ticket %s - %s", file_name, self.ticket_id, self.ticket_url)
+        self.request_result = self.get_ticket_content()
+        return self.request_result
+
+    def _post(self, url, params, error_log, files=None, error_markers=(), success_marker=None):
+        """
+        Sends a POST request to the RT API and parses the response for errors.
+        RT's API returns 200 even if the request failed, so the response body is checked for error markers.
+        If the session has expired, the request is sent again after authenticating again; if that doesn't help,
+        the request fails, whatever the error markers are.
+        The markers are checked against the raw response bytes; the body is only decoded on failure.
+        :param url: The URL to send the POST request to.
+        :param params: The payload to send in the POST request.
+        :param error_log: Message logged if the request raises an exception.
+        :param files: Optional files to send in the POST request.
+        :param error_markers: Byte strings indicating failure if found in the response body.
+        :param success_marker: Byte string indicating failure if not found in the response body.
+        :return: (ok, content, error_message): Whether the request succeeded, the raw response body and the
+                 error message.
+        """
         try:
-            r = self.s.post("{0}/ticket/{1}/comment".format(self.rest_url, self.ticket_id), data=params, files=files)
-            logger.debug("Add attachment: status code: {0}".format(r.status_code))
+            r = self._request('post', url, data=params, files=files)
+            logger.debug("POST %s: status code: %s", url, r.status_code)
             r.raise_for_status()
         except requests.RequestException as e:
-            logger.error("Error attaching file {0}".format(file_name))
+            logger.error(error_log)
             logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
+            return False, None, str(e)
 
-        # RT's API returns 200 even if the ticket is not valid. We need to parse the response.
-        if '200' not in r.text:
+        content = r.content
+        if _ERR_CREDENTIALS_REQUIRED in content or any(marker in content for marker in error_markers) or \
+                (success_marker and success_marker not in content):
             error_message = r.text.replace('\n', ' ')
             logger.error(error_message)
-            return self.request_result._replace(status='Failure', error_message=error_message)
-        logger.info("Attached file {0} to ticket {1} - {2}".format(file_name, self.ticket_id, self.ticket_url))
-        self.request_result = self.get_ticket_content()
-        return self.request_result
+            return False, content, error_message
+        return True, content, None
 
 
 def _prepare_ticket_fields(fields):
-        """
-        Makes sure each key value pair in the fields dictionary is in the correct form.
-        :param fields: Ticket fields.
-        :return: fields: Ticket fields in the correct form for the ticketing tool.
-        """
-        for key, value in list(fields.items()):
-            if key in ['cc', 'admincc']:
-                if isinstance(value, list):
-                    fields[key] = ', '.join(value)
-        return fields
+    """
+    Makes sure each key value pair in the fields dictionary is in the correct form.
+    :param fields: Ticket fields.
+    :return: fields: Ticket fields in the correct form for the ticketing tool.
+    """
+    # Only the cc fields need converting, so look them up directly instead of iterating over all fields.
+    for key in ('cc', 'admincc'):
+        value = fields.get(key)
+        if isinstance(value, list):
+            fields[key] = ', '.join(value)
+    return fields
 
 
 def _convert_string(text):
@@ -412,11 +529,10 @@ def _convert_string(text):
     :param text: Text to be converted in a form of string.
     :return: List of strings or a dictionary in dependance of which form is preferable.
     """
-    lines = text.split('\n')
     if 'Stack' in text:
         return text.split('\n')
     response = {'header': []}
-    for line in lines:
+    for line in text.split('\n'):
         if line:
             if ':' not in line:
                 response['header'].append(line)
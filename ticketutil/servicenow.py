@@ -1,27 +1,58 @@
+import base64
 import json
 import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import requests
 
-from ticketutil.ticket import Ticket
+from ticketutil.ticket import _mount_http_adapter, Ticket, TicketException
 
 __author__ = 'dranck, rnester, kshirsal, pzubaty'
 
 logger = logging.getLogger(__name__)
 
+# Names of the ServiceNow fields, for the ticket fields which are passed in under a different name.
+_FIELD_NAMES = {key: 'u_{0}'.format(key)
+                for key in ('opened_for', 'operating_system', 'category', 'item', 'severity', 'hostname_affected',
+                            'opened_by_dept')}
+_FIELD_NAMES.update({'topic': 'u_topic_reportable',
+                     'email_from': 'u_email_from_address'})
+
+# A sys_id is a 32 character hexadecimal string.
+_SYS_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# Headers of each request sent through the ServiceNow Batch API.
+_BATCH_HEADERS = [{'name': 'Content-Type', 'value': 'application/json'},
+                  {'name': 'Accept', 'value': 'application/json'}]
+
+# Available ticket states of the tables which have been verified, keyed by (url, project), with the time they
+# were looked up. The state choices of a table rarely change, so they are only looked up again after
+# _AVAILABLE_STATES_TTL seconds.
+_AVAILABLE_STATES_TTL = 300
+_available_states = {}
+
 
 class ServiceNowTicket(Ticket):
     """
     ServiceNow Ticket object. Contains ServiceNow specific methods for working
     with tickets.
     """
+    # _verify_project() also loads the available states of each ticket object, and caches them itself.
+    _cache_verified_projects = False
+    # Basic authentication is sent with every request, and the auth_url is the table itself, which would be listed
+    # just to check the credentials. _verify_project() checks the credentials of each new session instead.
+    skip_auth_probe = True
 
-    def __init__(self, url, project, auth=None, ticket_id=None):
+    def __init__(self, url, project, auth=None, ticket_id=None, session=None):
         """
         :param url: ServiceNow service url
         :param project: ServiceNow table or project
         :param auth: (<username>, <password>) for HTTP Basic Authentication
-        :param ticket_id: ticket number, eg. 'PNT1234567'
+        :param ticket_id: ticket number, eg. 'PNT1234567', or sys_id
+        :param session: session of another ServiceNowTicket object to share, instead of creating a new one
         """
         self.ticketing_tool = 'ServiceNow'
 
@@ -33,14 +64,77 @@ class ServiceNowTicket(Ticket):
         self.rest_url = '{0}/api/now/v1/table/{1}'.format(
                         self.url, self.project)
         self.auth_url = self.rest_url
+        self._attachment_url = '{0}/api/now/attachment/file?table_name={1}'.format(self.url, self.project)
+        self._sys_id = None
+        self.ticket_rest_url = None
+        self._ticket_url = None
+        self.ticket_content = None
+        self._pending = None
+        self.batch_result = None
 
         # Call our parent class's init method which creates our requests
         # session.
-        super(ServiceNowTicket, self).__init__(project, ticket_id)
+        super(ServiceNowTicket, self).__init__(project, ticket_id, session=session)
 
+    @classmethod
+    def bulk(cls, url, project, ticket_ids, auth=None, max_workers=8):
+        """
+        Creates ServiceNowTicket objects for several existing tickets concurrently.
+        The first object authenticates and creates the session, the others share it and are created in parallel
+        threads. The session keeps up to max_workers connections open for them. Closing the session of the first
+        object closes these connections; they are opened again if any of the objects is used afterwards. If any
+        ticket can't be opened, the session is closed and the exception is raised.
+
+        Example:
+        tickets = ServiceNowTicket.bulk(<url>, <table>, ['PNT0000001', 'PNT0000002'], auth=(<username>, <password>))
+
+        :param url: ServiceNow service url
+        :param project: ServiceNow table or project
+        :param ticket_ids: List of ticket numbers or sys_ids.
+        :param auth: (<username>, <password>) for HTTP Basic Authentication
+        :param max_workers: Maximum number of tickets read at the same time.
+        :return: tickets: List of ServiceNowTicket objects, in the order of ticket_ids.
+        """
+        if not ticket_ids:
+            return []
+        first = cls(url, project, auth=auth, ticket_id=ticket_ids[0])
+        try:
+            _mount_http_adapter(first.s, pool_maxsize=max_workers)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                others = list(executor.map(lambda ticket_id: cls(url, project, auth=auth, ticket_id=ticket_id,
+                                                                 session=first.s), ticket_ids[1:]))
+        except Exception:
+            first.close_requests_session()
+            raise
+        return [first] + others
+
+    def _create_requests_session(self):
+        """
+        Creates a Requests Session and sets the headers used by all ServiceNow API calls on it.
+        The headers are set once, before the project and ticket_id are verified.
+        :return s: Requests Session.
+        """
+        s = super(ServiceNowTicket, self)._create_requests_session()
         # For ServiceNow tickets, specify headers.
-        self.s.headers.update({'Content-Type': 'application/json',
-                               'Accept': 'application/json'})
+        if s:
+            s.headers.update({'Content-Type': 'application/json',
+                              'Accept': 'application/json'})
+        return s
+
+    @property
+    def sys_id(self):
+        """
+        The sys_id of the current ticket, used to address the ticket's record in the ServiceNow API.
+        :return: The sys_id.
+        """
+        return self._sys_id
+
+    @sys_id.setter
+    def sys_id(self, sys_id):
+        # Build the URLs of the ticket once, whenever the sys_id changes.
+        self._sys_id = sys_id
+        self.ticket_rest_url = '{0}/{1}'.format(self.rest_url, sys_id) if sys_id else None
+        self._ticket_url = '{0}/{1}.do?sys_id={2}'.format(self.url, self.project, sys_id) if sys_id else None
 
     def _verify_project(self, project):
         """
@@ -49,13 +143,27 @@ class ServiceNowTicket(Ticket):
         display values of available ticket states.
         :param project: The project table you're verifying.
         :return: True or False depending on if project is valid.
+        :raises TicketException: If the credentials are rejected.
         """
+        # The cached states are only used with a shared session, which has already authenticated. The states
+        # request is the first request of a new session, so it also checks the session's credentials.
+        cached = _available_states.get((self.url, project))
+        if not self._owns_session and cached and time.monotonic() - cached[0] < _AVAILABLE_STATES_TTL:
+            self.available_states = dict(cached[1])
+            logger.debug("Project %s is valid", project)
+            return True
+
         try:
-            r = self.s.get("{0}/api/now/table/sys_choice?sysparm_query=name={1}^element=state^inactive=false".format(
-                self.url, project))
-            logger.debug("Verify project: status code: {0}".format(r.status_code))
+            # Only the label and value of each state are used, so only request those fields.
+            r = self.s.get("{0}/api/now/table/sys_choice".format(self.url),
+                           params={'sysparm_query': 'name={0}^element=state^inactive=false'.format(project),
+                                   'sysparm_fields': 'label,value'})
+            logger.debug("Verify project: status code: %s", r.status_code)
             r.raise_for_status()
         except requests.RequestException as e:
+            if e.response is not None and e.response.status_code in (401, 403):
+                logger.error("Error authenticating to %s", self.auth_url)
+                raise TicketException("Error authenticating to {0}".format(self.auth_url)) from e
             logger.error("Unexpected error occurred when verifying project")
             logger.error(e)
             return False
@@ -65,14 +173,17 @@ class ServiceNowTicket(Ticket):
         for state in r.json()['result']:
             label = state['label'].lower()
             self.available_states[label] = state['value']
-        logger.debug("Project {0} is valid".format(project))
+        _available_states[(self.url, project)] = (time.monotonic(), dict(self.available_states))
+        logger.debug("Project %s is valid", project)
         return True
 
-    def get_ticket_content(self, ticket_id=None):
+    def get_ticket_content(self, ticket_id=None, fields=None):
         """
         Get ticket_content using ticket_id
 
-        :param ticket_id: ticket number, if not set self.ticket_id is used
+        :param ticket_id: ticket number or sys_id, if not set self.ticket_id is used
+        :param fields: list of ServiceNow field names to return, eg. ['number', 'state'], if not set all fields
+                       are returned
         :return: self.request_result: Named tuple containing request status, error_message, and url info.
         """
         if ticket_id is None:
@@ -83,9 +194,19 @@ class ServiceNowTicket(Ticket):
                 logger.error(error_message)
                 return self.request_result._replace(status='Failure', error_message=error_message)
 
+        # A ticket given by its sys_id is read directly from its record, instead of searching by number.
+        # Ticket numbers are unique, so the search can stop at the first match and needs no paging headers.
+        if _SYS_ID.match(ticket_id):
+            url, params = '{0}/{1}'.format(self.rest_url, ticket_id), None
+        else:
+            url, params = self.rest_url, {'sysparm_query': 'GOTOnumber={0}'.format(ticket_id), 'sysparm_limit': 1,
+                                          'sysparm_suppress_pagination_header': 'true'}
+        if fields:
+            params = dict(params or {}, sysparm_fields=','.join(fields))
+
         try:
-            r = self.s.get("{0}?sysparm_query=GOTOnumber%3D{1}".format(self.rest_url, ticket_id))
-            logger.debug("Get ticket content: status code: {0}".format(r.status_code))
+            r = self.s.get(url, params=params)
+            logger.debug("Get ticket content: status code: %s", r.status_code)
             r.raise_for_status()
         except requests.RequestException as e:
             error_message = "Error getting ticket content"
@@ -93,24 +214,32 @@ class ServiceNowTicket(Ticket):
             logger.error(e)
             return self.request_result._replace(status='Failure', error_message=error_message)
 
-        ticket_content = r.json()
-        return self.request_result._replace(ticket_content=ticket_content['result'][0])
+        # The query returns an empty result if the ticket does not exist.
+        try:
+            ticket_content = r.json()['result']
+            if not _SYS_ID.match(ticket_id):
+                ticket_content = ticket_content[0]
+        except (ValueError, KeyError, IndexError):
+            error_message = "Ticket {0} is not valid".format(ticket_id)
+            logger.error(error_message)
+            return self.request_result._replace(status='Failure', error_message=error_message)
+        return self.request_result._replace(ticket_content=ticket_content)
 
     def _verify_ticket_id(self, ticket_id):
         """
         Calls get_ticket_content to make sure ticket if valid.
+        The ticket_id is set to the ticket number, also if the ticket was given by its sys_id.
         :param ticket_id: The ticket you're verifying.
         :return: True or False depending on if ticket is valid.
         """
         result = self.get_ticket_content(ticket_id)
         if 'Failure' in result.status:
-            logger.error("Ticket {0} is not valid".format(ticket_id))
+            logger.error("Ticket %s is not valid", ticket_id)
             return False
-        logger.debug("Ticket {0} is valid".format(ticket_id))
-        self.ticket_id = ticket_id
+        logger.debug("Ticket %s is valid", ticket_id)
         self.ticket_content = result.ticket_content
+        self.ticket_id = self.ticket_content['number']
         self.sys_id = self.ticket_content['sys_id']
-        self.ticket_rest_url = self.rest_url + '/' + self.sys_id
         return True
 
     def _generate_ticket_url(self):
@@ -119,17 +248,16 @@ class ServiceNowTicket(Ticket):
 
         :return: ticket_url: The URL of the ticket.
         """
-        ticket_url = None
-
-        # If we are receiving a ticket_id, we have sys_id
-        if self.sys_id:
-            ticket_url = '{0}/{1}.do?sys_id={2}'.format(self.url, self.project,
-                                                        self.sys_id)
+        # The URL is built by the sys_id setter, so it is None until we have a sys_id.
+        ticket_url = self._ticket_url
 
         # This method is called from set_ticket_id(), _create_ticket_request(), or Ticket.__init__().
         # If this method is being called, we want to update the url field in our Result namedtuple.
-        content = self.get_ticket_content()
-        self.request_result = self.request_result._replace(url=ticket_url, ticket_content=content.ticket_content)
+        # Each caller has just read the ticket, so the content is only fetched again if it is missing.
+        ticket_content = self.ticket_content
+        if ticket_content is None:
+            ticket_content = self.get_ticket_content().ticket_content
+        self.request_result = self.request_result._replace(url=ticket_url, ticket_content=ticket_content)
 
         return ticket_url
 
@@ -153,16 +281,12 @@ class ServiceNowTicket(Ticket):
 
         :return: self.request_result: Named tuple containing request status, error_message, and url info.
         """
-        error_message = ""
-        if description is None:
-            error_message = "description is a necessary parameter for ticket creation"
-        if short_description is None:
-            error_message = "short_description is a necessary parameter for ticket creation"
-        if category is None:
-            error_message = "category is a necessary parameter for ticket creation"
-        if item is None:
-            error_message = "item is a necessary parameter for ticket creation"
-        if error_message:
+        # Report the first missing parameter, in the order of the method's arguments.
+        required_args = (('short_description', short_description), ('description', description),
+                         ('category', category), ('item', item))
+        missing = [name for name, value in required_args if value is None]
+        if missing:
+            error_message = "{0} is a necessary parameter for ticket creation".format(missing[0])
             logger.error(error_message)
             return self.request_result._replace(status='Failure', error_message=error_message)
 
@@ -180,14 +304,9 @@ class ServiceNowTicket(Ticket):
         Creates the payload for the POST request when creating new ticket.
 
         :param fields: optional fields
+        :return: params: The payload for the request, serialised to JSON by requests.
         """
-        fields = _prepare_ticket_fields(fields)
-
-        params = ''
-        for key, value in fields.items():
-            params += ', {} : {}'.format(json.dumps(key), json.dumps(value))
-        params = '{' + params[1:] + '}'
-        return params
+        return _prepare_ticket_fields(fields)
 
     def _create_ticket_request(self, params):
         """
@@ -196,23 +315,15 @@ class ServiceNowTicket(Ticket):
         :param params: The payload to send in the POST request.
         :return: self.request_result: Named tuple containing request status, error_message, and url info.
         """
-        try:
-            r = self.s.post(self.rest_url, data=params)
-            logger.debug("Create ticket: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error("Error creating ticket")
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
-
-        ticket_content = r.json()
-        self.ticket_content = ticket_content['result']
+        ticket_content, error_message = self._send('post', self.rest_url, params, "Error creating ticket")
+        if ticket_content is None:
+            return self.request_result._replace(status='Failure', error_message=error_message)
 
+        self.ticket_content = ticket_content
         self.ticket_id = self.ticket_content['number']
         self.sys_id = self.ticket_content['sys_id']
         self.ticket_url = self._generate_ticket_url()
-        self.ticket_rest_url = self.rest_url + '/' + self.sys_id
-        logger.info("Created ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
+        logger.info("Created ticket %s - %s", self.ticket_id, self.ticket_url)
 
         # Update our ticket_content field and return the result
         self.request_result = self.request_result._replace(ticket_content=self.ticket_content)
@@ -237,23 +348,7 @@ class ServiceNowTicket(Ticket):
             logger.error(error_message)
             return self.request_result._replace(status='Failure', error_message=error_message)
 
-        params = self._create_ticket_parameters(fields)
-
-        try:
-            r = self.s.put(self.ticket_rest_url, data=params)
-            logger.debug("Change status: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error('Failed to change ticket status')
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
-
-        self.ticket_content = r.json()['result']
-        logger.info("Changed status of ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
-
-        # Update our ticket_content field and return the result
-        self.request_result = self.request_result._replace(ticket_content=self.ticket_content)
-        return self.request_result
+        return self._update_ticket(fields, 'Failed to change ticket status', 'Changed status of ticket')
 
     def edit(self, **kwargs):
         """
@@ -278,23 +373,7 @@ class ServiceNowTicket(Ticket):
             logger.error(error_message)
             return self.request_result._replace(status='Failure', error_message=error_message)
 
-        params = self._create_ticket_parameters(kwargs)
-
-        try:
-            r = self.s.put(self.ticket_rest_url, data=params)
-            logger.debug("Edit ticket: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error("Error editing ticket")
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
-
-        self.ticket_content = r.json()['result']
-        logger.info("Edited ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
-
-        # Update our ticket_content field and return the result
-        self.request_result = self.request_result._replace(ticket_content=self.ticket_content)
-        return self.request_result
+        return self._update_ticket(kwargs, 'Error editing ticket', 'Edited ticket')
 
     def add_comment(self, comment):
         """
@@ -308,23 +387,7 @@ class ServiceNowTicket(Ticket):
             logger.error(error_message)
             return self.request_result._replace(status='Failure', error_message=error_message)
 
-        params = self._create_ticket_parameters({'comments': comment})
-
-        try:
-            r = self.s.put(self.ticket_rest_url, data=params)
-            logger.debug("Add comment: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error('Failed to add the comment')
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
-
-        self.ticket_content = r.json()['result']
-        logger.info("Added comment to ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
-
-        # Update our ticket_content field and return the result
-        self.request_result = self.request_result._replace(ticket_content=self.ticket_content)
-        return self.request_result
+        return self._update_ticket({'comments': comment}, 'Failed to add the comment', 'Added comment to ticket')
 
     def add_cc(self, user):
         """
@@ -337,32 +400,18 @@ class ServiceNowTicket(Ticket):
             logger.error(error_message)
             return self.request_result._replace(status='Failure', error_message=error_message)
 
-        watch_list = self.ticket_content['watch_list'].split(',')
-        watch_list = [item.strip() for item in watch_list]
+        watch_list = self._get_watch_list()
         if isinstance(user, str):
             user = [user]
+        # Use a set for the membership checks, and keep the list to preserve the order of the watch list.
+        watchers = set(watch_list)
         for item in user:
-            if item not in watch_list:
+            if item not in watchers:
+                watchers.add(item)
                 watch_list.append(item)
 
         fields = {'watch_list': ', '.join(watch_list)}
-        params = self._create_ticket_parameters(fields)
-
-        try:
-            r = self.s.put(self.ticket_rest_url, data=params)
-            logger.debug("Add cc: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error('Failed to add user(s) to CC list')
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
-
-        self.ticket_content = r.json()['result']
-        logger.info("Added user(s) to cc list of ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
-
-        # Update our ticket_content field and return the result
-        self.request_result = self.request_result._replace(ticket_content=self.ticket_content)
-        return self.request_result
+        return self._update_ticket(fields, 'Failed to add user(s) to CC list', 'Added user(s) to cc list of ticket')
 
     def rewrite_cc(self, user):
         """
@@ -378,23 +427,7 @@ class ServiceNowTicket(Ticket):
         if isinstance(user, str):
             user = [user]
         fields = {'watch_list': ', '.join(user)}
-        params = self._create_ticket_parameters(fields)
-
-        try:
-            r = self.s.put(self.ticket_rest_url, data=params)
-            logger.debug("Rewrite cc: status code: {0}".format(r.status_code))
-            r.raise_for_status()
-        except requests.RequestException as e:
-            logger.error('Failed to rewrite CC list')
-            logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
-
-        self.ticket_content = r.json()['result']
-        logger.info("Rewrote cc list of ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
-
-        # Update our ticket_content field and return the result
-        self.request_result = self.request_result._replace(ticket_content=self.ticket_content)
-        return self.request_result
+        return self._update_ticket(fields, 'Failed to rewrite CC list', 'Rewrote cc list of ticket')
 
     def remove_cc(self, user):
         """
@@ -407,32 +440,176 @@ class ServiceNowTicket(Ticket):
             logger.error(error_message)
             return self.request_result._replace(status='Failure', error_message=error_message)
 
-        watch_list = self.ticket_content['watch_list'].split(',')
-        watch_list = [item.strip() for item in watch_list]
+        watch_list = self._get_watch_list()
         if isinstance(user, str):
             user = [user]
-        for item in user:
-            if item in watch_list:
-                watch_list.remove(item)
+        removed = set(user)
+        watch_list = [item for item in watch_list if item not in removed]
         fields = {'watch_list': ', '.join(watch_list)}
-        params = self._create_ticket_parameters(fields)
+        return self._update_ticket(fields, 'Failed to remove user(s) from CC list',
+                                   'Removed user(s) from cc list of ticket')
+
+    @contextmanager
+    def batch(self):
+        """
+        Collects the changes made by edit(), add_comment(), change_status(), add_cc(), rewrite_cc() and
+        remove_cc() inside the with block, and sends them to ServiceNow in a single request when the block exits.
+        If a field is changed more than once, the last value is sent; comments are combined into one comment.
+        The result of the request is stored in self.batch_result. Nothing is sent if the block raises an exception.
+        A nested batch() block adds its changes to the enclosing block, which sends them all when it exits.
+
+        Example:
+        with ticket.batch():
+            ticket.add_comment('Resolving ticket')
+            ticket.change_status('Resolved')
+        """
+        if self._pending is not None:
+            yield self
+            return
+        self._pending = {}
+        try:
+            yield self
+            pending = self._pending
+        finally:
+            self._pending = None
+        if pending:
+            self.batch_result = self._update_ticket(pending, 'Error updating ticket', 'Updated ticket')
+        else:
+            self.batch_result = self.request_result
+
+    @classmethod
+    def update_via_batch_api(cls, session, url, updates):
+        """
+        Sends the updates of several ServiceNow tickets to the ServiceNow Batch API in a single request,
+        instead of sending one PUT request per ticket.
+
+        Example:
+        ServiceNowTicket.update_via_batch_api(ticket1.s, <url>,
+                                              [(ticket1, {'comments': 'Resolving ticket'}),
+                                               (ticket2, {'priority': '2', 'assigned_to': 'pzubaty'})])
+
+        :param session: Authenticated Requests Session to send the request with, eg. the session of a ticket object
+                        of the ServiceNow instance.
+        :param url: ServiceNow service url
+        :param updates: List of (ticket, fields) pairs, where ticket is a ServiceNowTicket object with a ticket ID
+                        set and fields is a dictionary of the ticket fields to update, as passed to edit().
+                        Tickets without a ticket ID, or of another ServiceNow instance, are not sent and get a
+                        Failure result.
+        :return: results: List of the request results, in the order of the updates.
+        """
+        # Tickets which can't be sent get their failure result straight away, the others get theirs from the
+        # batch response.
+        url = url[:-1] if url.endswith('/') else url
+        results = [None] * len(updates)
+        rest_requests = []
+        for index, (ticket, fields) in enumerate(updates):
+            if not ticket.ticket_id or not ticket.sys_id:
+                error_message = "No ticket ID associated with ticket object. " \
+                                "Set ticket ID with set_ticket_id(<ticket_id>)"
+            elif ticket.url != url:
+                error_message = "Ticket belongs to another ServiceNow instance: {0}".format(ticket.url)
+            else:
+                body = json.dumps(_prepare_ticket_fields(fields)).encode('utf-8')
+                rest_requests.append({'id': str(index),
+                                      'method': 'PUT',
+                                      'url': '/api/now/v1/table/{0}/{1}'.format(ticket.project, ticket.sys_id),
+                                      'headers': _BATCH_HEADERS,
+                                      'body': base64.b64encode(body).decode('ascii')})
+                continue
+            logger.error(error_message)
+            results[index] = ticket.request_result._replace(status='Failure', error_message=error_message)
+        if not rest_requests:
+            return results
 
         try:
-            r = self.s.put(self.ticket_rest_url, data=params)
-            logger.debug("Remove cc: status code: {0}".format(r.status_code))
+            r = session.post('{0}/api/now/v1/batch'.format(url),
+                             json={'batch_request_id': '1', 'rest_requests': rest_requests})
+            logger.debug("Batch request: status code: %s", r.status_code)
             r.raise_for_status()
         except requests.RequestException as e:
-            logger.error('Failed to remove user(s) from CC list')
+            logger.error("Error sending batch request")
             logger.error(e)
-            return self.request_result._replace(status='Failure', error_message=str(e))
+            for rest_request in rest_requests:
+                index = int(rest_request['id'])
+                results[index] = updates[index][0].request_result._replace(status='Failure', error_message=str(e))
+            return results
+
+        # The responses are matched to the updates by id, as ServiceNow may not return them in order.
+        responses = {response['id']: response for response in r.json().get('serviced_requests', [])}
+        for rest_request in rest_requests:
+            index = int(rest_request['id'])
+            ticket = updates[index][0]
+            response = responses.get(rest_request['id'])
+            if response is None:
+                error_message = "Request was not serviced"
+            elif response['status_code'] >= 300:
+                error_message = response.get('status_text') or str(response['status_code'])
+            else:
+                ticket.ticket_content = json.loads(base64.b64decode(response['body']).decode('utf-8'))['result']
+                ticket.request_result = ticket.request_result._replace(ticket_content=ticket.ticket_content)
+                logger.info("Updated ticket %s - %s", ticket.ticket_id, ticket.ticket_url)
+                results[index] = ticket.request_result
+                continue
+            logger.error("Failed to update ticket %s: %s", ticket.ticket_id, error_message)
+            results[index] = ticket.request_result._replace(status='Failure', error_message=error_message)
+        return results
+
+    def _get_watch_list(self):
+        """
+        Returns the current watch list of the ticket, including changes waiting to be sent in a batch.
+        :return: List of users.
+        """
+        if self._pending and 'watch_list' in self._pending:
+            return _split_watch_list(self._pending['watch_list'])
+        return _split_watch_list(self.ticket_content['watch_list'])
 
-        self.ticket_content = r.json()['result']
-        logger.info("Removed user(s) from cc list of ticket {0} - {1}".format(self.ticket_id, self.ticket_url))
+    def _update_ticket(self, fields, error_log, action):
+        """
+        Sends a PUT request updating the given fields of the ticket.
+        Inside a batch() block, the fields are added to the pending changes instead.
+        :param fields: Ticket fields to update.
+        :param error_log: Message logged if the request fails.
+        :param action: Description of the change, used for logging.
+        :return: self.request_result: Named tuple containing request status, error_message, and url info.
+        """
+        if self._pending is not None:
+            if 'comments' in fields and self._pending.get('comments'):
+                fields = dict(fields, comments='{0}\n\n{1}'.format(self._pending['comments'], fields['comments']))
+            self._pending.update(fields)
+            return self.request_result
+
+        params = self._create_ticket_parameters(fields)
+        ticket_content, error_message = self._send('put', self.ticket_rest_url, params, error_log)
+        if ticket_content is None:
+            return self.request_result._replace(status='Failure', error_message=error_message)
+
+        self.ticket_content = ticket_content
+        logger.info("%s %s - %s", action, self.ticket_id, self.ticket_url)
 
         # Update our ticket_content field and return the result
         self.request_result = self.request_result._replace(ticket_content=self.ticket_content)
         return self.request_result
 
+    def _send(self, method, url, params, error_log):
+        """
+        Sends a request with a JSON payload to the ServiceNow API.
+        :param method: The HTTP method of the request, 'post' or 'put'.
+        :param url: The URL to send the request to.
+        :param params: The payload to send in the request.
+        :param error_log: Message logged if the request fails.
+        :return: (ticket_content, error_message): The ticket record returned by ServiceNow, or None and the
+                 error message if the request failed.
+        """
+        try:
+            r = getattr(self.s, method)(url, json=params)
+            logger.debug("%s %s: status code: %s", method.upper(), url, r.status_code)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            logger.error(error_log)
+            logger.error(e)
+            return None, str(e)
+        return r.json()['result'], None
+
     def add_attachment(self, file_name, name=None):
         """
         Attaches a file to a ServiceNow ticket.
@@ -448,18 +625,18 @@ class ServiceNowTicket(Ticket):
         if not name:
             name = file_name
 
-        url = '{}/api/now/attachment/file?table_name={}&table_sys_id={}&file_name={}'.format(self.url, self.project,
-                                                                                             self.sys_id, name)
+        # Let requests encode the file name, which may contain spaces or characters such as '&'.
+        params = {'table_sys_id': self.sys_id, 'file_name': name}
         try:
+            # Pass the open file, so the upload is streamed from disk instead of being read into memory first.
             with open(file_name, 'rb') as f:
-                data = f.read()
-            r = self.s.post(url, data=data)
-            logger.debug("Add attachment: status code: {0}".format(r.status_code))
+                r = self.s.post(self._attachment_url, params=params, data=f)
+            logger.debug("Add attachment: status code: %s", r.status_code)
             r.raise_for_status()
-            logger.info("Attached file {0} to ticket {1} - {2}".format(file_name, self.ticket_id, self.ticket_url))
+            logger.info("Attached file %s to ticket %s - %s", file_name, self.ticket_id, self.ticket_url)
             return self.request_result
         except requests.RequestException as e:
-            logger.error("Error attaching file {0}".format(file_name))
+            logger.error("Error attaching file %s", file_name)
             logger.error(e)
             return self.request_result._replace(status='Failure', error_message=str(e))
         except IOError:
@@ -468,6 +645,68 @@ class ServiceNowTicket(Ticket):
             return self.request_result._replace(status='Failure', error_message=error_message)
 
 
+class ServiceNowBatch(object):
+    """
+    Runs operations on several ServiceNow tickets concurrently.
+    Operations on different ServiceNowTicket objects run in parallel threads, so their requests overlap
+    instead of waiting for each other. Operations on the same object run one after another, in the order
+    they were added.
+    """
+
+    def __init__(self, max_workers=10):
+        """
+        :param max_workers: Maximum number of tickets worked on at the same time.
+        """
+        self.max_workers = max_workers
+        self.operations = []
+
+    def add(self, ticket, method, *args, **kwargs):
+        """
+        Adds an operation to the batch.
+
+        Example:
+        batch.add(ticket, 'edit', priority='2')
+
+        :param ticket: The ServiceNowTicket object to work with.
+        :param method: Name of the ServiceNowTicket method to call, eg. 'add_comment'.
+        :param args: Positional arguments of the method.
+        :param kwargs: Keyword arguments of the method.
+        :return:
+        """
+        self.operations.append((ticket, method, args, kwargs))
+
+    def execute(self):
+        """
+        Runs all operations added to the batch and empties the batch.
+        :return: results: List of the request results, in the order the operations were added.
+        """
+        operations, self.operations = self.operations, []
+        results = [None] * len(operations)
+
+        # Group the operations by ticket object, as a ticket object can only run one operation at a time.
+        tickets = {}
+        for index, (ticket, method, args, kwargs) in enumerate(operations):
+            tickets.setdefault(id(ticket), []).append((index, ticket, method, args, kwargs))
+
+        def run(ticket_operations):
+            for index, ticket, method, args, kwargs in ticket_operations:
+                results[index] = getattr(ticket, method)(*args, **kwargs)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Consume the iterator so that exceptions raised in the threads are propagated.
+            list(executor.map(run, tickets.values()))
+        return results
+
+
+def _split_watch_list(watch_list):
+    """
+    Splits the comma separated watch list of a ticket into a list of users.
+    :param watch_list: The watch_list field of the ticket.
+    :return: List of users, without empty entries.
+    """
+    return [item.strip() for item in watch_list.split(',') if item.strip()]
+
+
 def _prepare_ticket_fields(fields):
     """
     Makes sure each key value pair in the fields dictionary is in
@@ -475,18 +714,7 @@ def _prepare_ticket_fields(fields):
     :param fields: Ticket fields.
     :return: fields: Ticket fields for the ticketing tool.
     """
-    for key, value in list(fields.items()):
-        if key in ['opened_for', 'operating_system', 'category', 'item',
-                   'severity', 'hostname_affected', 'opened_by_dept']:
-            fields['u_{}'.format(key)] = value
-            fields.pop(key)
-        if key == 'topic':
-            fields['u_topic_reportable'] = value
-            fields.pop(key)
-        if key == 'email_from':
-            fields['u_email_from_address'] = value
-            fields.pop(key)
-    return fields
+    return {_FIELD_NAMES.get(key, key): value for key, value in fields.items()}
 
 
 def main():
@@ -1,18 +1,21 @@
 import logging
+import os
 from collections import namedtuple
 
-import gssapi
 import requests
-from requests.adapters import HTTPAdapter, Retry
-from requests_kerberos import DISABLED, HTTPKerberosAuth
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter, Retry
+import urllib3
 
 __author__ = 'dranck, rnester, kshirsal'
 
-# Disable warnings for requests because we aren't doing certificate verification
-requests.packages.urllib3.disable_warnings()
+# Disable the insecure request warnings because we aren't doing certificate verification
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
+# Kerberos principals which have been looked up, keyed by credential cache (the KRB5CCNAME environment variable).
+_kerberos_principals = {}
+
 
 class TicketException(Exception):
     """An issue occurred when performing a ticketing operation."""
@@ -22,7 +25,22 @@ class Ticket(object):
     """
     A class representing a ticket.
     """
-    def __init__(self, project, ticket_id, verify=False):
+    # Projects which have been verified, keyed by (auth_url, project, user), so that each project is only verified
+    # once per process and user. Subclasses whose _verify_project() sets up instance state turn this off.
+    _verified_projects = set()
+    _cache_verified_projects = True
+    # Subclasses whose first request after creating the session authenticates anyway can skip the request to
+    # auth_url. Authentication errors are then reported by that first request instead.
+    skip_auth_probe = False
+
+    def __init__(self, project, ticket_id, verify=False, session=None):
+        """
+        :param project: The project of the ticket.
+        :param ticket_id: The ticket to work with, or None.
+        :param verify: Whether to verify the TLS certificate of the ticketing tool.
+        :param session: An authenticated Requests Session to use instead of creating a new one, eg. the session of
+                        another ticket object of the same ticketing tool. The session is not closed by this object.
+        """
         self.project = project
         self.ticket_id = ticket_id
         self.ticket_url = None
@@ -32,14 +50,23 @@ class Ticket(object):
         Result = namedtuple('Result', ['status', 'error_message', 'url', 'ticket_content'])
         self.request_result = Result('Success', None, None, None)
 
-        # Create our requests session below. Raise an exception if a session object is not returned.
-        self.s = self._create_requests_session()
+        # Create our requests session below, unless one was passed in. The base implementation raises if
+        # authentication fails; raise an exception as well if a subclass's implementation does not return a session.
+        self._owns_session = session is None
+        self.s = session if session is not None else self._create_requests_session()
         if not self.s:
             raise TicketException("Error authenticating to {0}".format(self.auth_url))
 
-        # Verify that project is valid.
-        if not self._verify_project(self.project):
-            raise TicketException("Project {0} is not valid".format(self.project))
+        # Verify that project is valid, unless the same user has already verified it. Projects are verified every
+        # time if the user is not known, as another user may not have access to them.
+        user = self._get_auth_user()
+        key = (self.auth_url, self.project, user)
+        cache = self._cache_verified_projects and user is not None
+        if not (cache and key in Ticket._verified_projects):
+            if not self._verify_project(self.project):
+                raise TicketException("Project {0} is not valid".format(self.project))
+            if cache:
+                Ticket._verified_projects.add(key)
 
         # Verify that optional ticket_id parameter is valid. If valid, generate ticket_url.
         if self.ticket_id:
@@ -48,6 +75,26 @@ class Ticket(object):
             else:
                 self.ticket_url = self._generate_ticket_url()
 
+    @classmethod
+    def invalidate_project_cache(cls):
+        """
+        Forgets which projects have been verified, so that they are verified again by the next Ticket object.
+        :return:
+        """
+        Ticket._verified_projects.clear()
+
+    def _get_auth_user(self):
+        """
+        Returns the user the ticket object authenticates as: the username of HTTP Basic Auth, or the credential
+        cache of Kerberos Auth, which identifies the principal without looking it up.
+        :return: The user, or None if it is not known.
+        """
+        if isinstance(self.auth, tuple):
+            return self.auth[0]
+        if self.auth == 'kerberos':
+            return 'kerberos', os.environ.get('KRB5CCNAME')
+        return None
+
     def _verify_ticket_id(self, ticket_id):
         """
         Check if ticket_id is connected with valid ticket for the given ticketing tool instance.
@@ -56,25 +103,29 @@ class Ticket(object):
         """
         result = self.get_ticket_content(ticket_id)
         if 'Failure' in result.status:
-            logger.error("Ticket {0} is not valid".format(ticket_id))
+            logger.error("Ticket %s is not valid", ticket_id)
             return False
-        logger.debug("Ticket {0} is valid".format(ticket_id))
+        logger.debug("Ticket %s is valid", ticket_id)
         self.ticket_id = ticket_id
         return True
 
     def set_ticket_id(self, ticket_id):
         """
         Sets the ticket_id and ticket_url instance vars for the current Ticket object.
+        If the ticket is already the current ticket, it is not verified again.
         :param ticket_id: Ticket id you would like to set.
         :return: self.request_result: Named tuple containing status, error_message, and url info.
         """
+        if ticket_id == self.ticket_id and self.ticket_url:
+            logger.debug("Ticket %s is already the current ticket", ticket_id)
+            return self.request_result
+        # _verify_ticket_id() sets ticket_id, in the form the ticketing tool reports it.
         if self._verify_ticket_id(ticket_id):
-            self.ticket_id = ticket_id
             self.ticket_url = self._generate_ticket_url()
-            logger.info("Current ticket: {0} - {1}".format(self.ticket_id, self.ticket_url))
+            logger.info("Current ticket: %s - %s", self.ticket_id, self.ticket_url)
             return self.request_result
         else:
-            logger.error("Unable to set ticket id to {0}".format(ticket_id))
+            logger.error("Unable to set ticket id to %s", ticket_id)
             error_message = "Ticket ID not valid"
             return self.request_result._replace(status='Failure', error_message=error_message)
 
@@ -83,7 +134,7 @@ class Ticket(object):
         Returns the ticket_id for the current Ticket object.
         :return: self.ticket_id: The ID of the ticket.
         """
-        logger.info("Returned ticket id: {0}".format(self.ticket_id))
+        logger.info("Returned ticket id: %s", self.ticket_id)
         return self.ticket_id
 
     def get_ticket_url(self):
@@ -91,7 +142,7 @@ class Ticket(object):
         Returns the ticket_url for the current Ticket object.
         :return: self.ticket_url: The URL of the ticket.
         """
-        logger.info("Returned ticket url: {0}".format(self.ticket_url))
+        logger.info("Returned ticket url: %s", self.ticket_url)
         return self.ticket_url
 
     def _create_requests_session(self):
@@ -99,61 +150,118 @@ class Ticket(object):
         Creates a Requests Session and authenticates to base API URL with kerberos-requests.
         We're using a Session to persist cookies across all requests made from the Session instance.
         :return s: Requests Session.
+        :raises TicketException: If authentication fails. The requests exception is chained as its cause.
         """
         # TODO: Support other authentication methods.
         # Set up authentication for requests session.
         s = requests.Session()
-        retries = Retry(
-            total=8, backoff_factor=0.1, status_forcelist=[ 500, 502, 503, 504 ]
-        )
-        adapter = HTTPAdapter(max_retries=retries)
-        s.mount('http://', adapter)
-        s.mount('https://', adapter)
+        _mount_http_adapter(s)
 
-        if self.auth == 'kerberos':
-            self.principal = _get_kerberos_principal()
-            s.auth = HTTPKerberosAuth(mutual_authentication=DISABLED)
-            s.verify = self.verify
         if isinstance(self.auth, tuple):
-            s.auth = self.auth
-            s.verify = self.verify
+            _setup_basic_auth(self, s)
+        elif isinstance(self.auth, str) and self.auth in _AUTH_SETUP:
+            _AUTH_SETUP[self.auth](self, s)
         if hasattr(self, 'headers'):
             s.headers = self.headers
         # Proxy setup
         if hasattr(self, 'proxies'):
             s.proxies.update(self.proxies)
+        if self.skip_auth_probe:
+            return s
         # Try to authenticate to auth_url.
         try:
             r = s.get(self.auth_url)
-            logger.debug("Create requests session: status code: {0}".format(r.status_code))
+            logger.debug("Create requests session: status code: %s", r.status_code)
             r.raise_for_status()
-            logger.info("Successfully authenticated to {0}".format(self.ticketing_tool))
+            logger.info("Successfully authenticated to %s", self.ticketing_tool)
             return s
         except requests.RequestException as e:
-            logger.error("Error authenticating to {0}".format(self.auth_url))
-            logger.error(e)
+            logger.error("Error authenticating to %s", self.auth_url)
             s.close()
+            raise TicketException("Error authenticating to {0}".format(self.auth_url)) from e
 
     def close_requests_session(self):
         """
-        Closes requests session for Ticket object.
-        :return:
+        Closes requests session for Ticket object. Closing it again is harmless, and if the object is used after
+        the session is closed, the session opens new connections.
+        A session which was passed in to the Ticket object is left open, for the other objects using it.
+        :return: self.request_result: Named tuple containing request status, error_message, and url info.
         """
-        if self.s:
+        if self.s and self._owns_session:
             self.s.close()
-            return self.request_result
+        return self.request_result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_requests_session()
+
+
+def _mount_http_adapter(s, pool_maxsize=DEFAULT_POOLSIZE):
+    """
+    Mounts an HTTPAdapter which retries failed requests on the Requests Session.
+    The adapter keeps connections to the ticketing tool in its pool and reuses them, so the host name
+    is only resolved when a new connection has to be opened.
+    :param s: Requests Session.
+    :param pool_maxsize: Maximum number of connections kept per host, ie. of requests sent at the same time.
+    :return:
+    """
+    retries = Retry(
+        total=8, backoff_factor=0.1, status_forcelist=[500, 502, 503, 504]
+    )
+    adapter = HTTPAdapter(max_retries=retries, pool_maxsize=pool_maxsize)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+
+
+def _setup_kerberos_auth(ticket, s):
+    """
+    Sets up kerberos authentication on the Requests Session.
+    Kerberos support is only imported when it is used, so tuple auth users don't load gssapi.
+    :param ticket: Ticket object being authenticated.
+    :param s: Requests Session.
+    :return:
+    """
+    from requests_kerberos import DISABLED, HTTPKerberosAuth
+    ticket.principal = _get_kerberos_principal()
+    s.auth = HTTPKerberosAuth(mutual_authentication=DISABLED)
+    s.verify = ticket.verify
+
+
+def _setup_basic_auth(ticket, s):
+    """
+    Sets up HTTP Basic authentication on the Requests Session from a (username, password) tuple.
+    :param ticket: Ticket object being authenticated.
+    :param s: Requests Session.
+    :return:
+    """
+    s.auth = ticket.auth
+    s.verify = ticket.verify
+
+
+# Session setup for named authentication methods. Tuple auth is handled by _setup_basic_auth.
+_AUTH_SETUP = {'kerberos': _setup_kerberos_auth}
 
 
 def _get_kerberos_principal():
     """
     Use gssapi to get the current kerberos principal.
     This will be used as the requester for some tools when creating tickets.
+    The principal is looked up once per credential cache; lookups which found no credentials are not cached.
     :return: The kerberos principal.
     """
+    ccache = os.environ.get('KRB5CCNAME')
+    if ccache in _kerberos_principals:
+        return _kerberos_principals[ccache]
+
+    import gssapi
     try:
-        return str(gssapi.Credentials(usage='initiate').name).lower()
+        principal = str(gssapi.Credentials(usage='initiate').name).lower()
     except gssapi.raw.misc.GSSError:
         return None
+    _kerberos_principals[ccache] = principal
+    return principal
 
 
 def main():